@@ -1,83 +1,347 @@
 #!/usr/bin/env python3
-"""Demo script that generates JWTs and runs curl commands against the gateway."""
+"""Demo script that generates JWTs and runs libcurl requests against the gateway."""
 
+import base64
+import functools
+import hashlib
+import hmac
 import json
 import os
-import subprocess
+import re
 import sys
 import time
+from collections import Counter, namedtuple
+from email.parser import BytesHeaderParser
+from io import BytesIO
 
-import jwt
+import pycurl
 
 
 GATEWAY = "http://gateway:8080"
 SECRET = os.environ["JWT_SECRET"]
-
-passed = 0
-failed = 0
-
-HEADER_DUMP = "/tmp/resp_headers.txt"
-
-
+# Pass --verbose (or set DEMO_VERBOSE=1) to pretty-print JSON response bodies
+VERBOSE = "--verbose" in sys.argv[1:] or os.environ.get("DEMO_VERBOSE") == "1"
+
+# (ok, message) pairs recorded by check(); main() tallies them and repeats
+# the failed messages in its summary
+results = []
+
+# Every gateway metric family, plus the labelled samples the demo expects to
+# see in /metrics.
+METRIC_FAMILIES = (
+    "gateway_requests_total",
+    "gateway_request_duration_seconds",
+    "gateway_active_connections",
+    "gateway_rate_limit_hits_total",
+    "gateway_auth_failures_total",
+    "gateway_backend_errors_total",
+    "gateway_retries_total",
+)
+METRIC_SAMPLES = (
+    "/api/users",
+    'route="/api/users"',
+    'status="502"',
+    'gateway_auth_failures_total{reason="missing_token"}',
+    'gateway_auth_failures_total{reason="invalid_token"}',
+    'gateway_auth_failures_total{reason="insufficient_scope"}',
+    "gateway_request_duration_seconds_bucket{",
+    "gateway_rate_limit_hits_total{",
+    "gateway_backend_errors_total{",
+    "gateway_retries_total{",
+)
+METRIC_TOKENS = METRIC_FAMILIES + METRIC_SAMPLES
+
+# Pulls every X-Request-ID value out of a block of raw response headers.
+REQUEST_ID_RE = re.compile(rb"^x-request-id:[ \t]*(\S+)", re.IGNORECASE | re.MULTILINE)
+
+# A canonical lowercase UUID as emitted in X-Request-ID
+UUID_RE = re.compile(r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}")
+
+# Hardening headers the gateway adds to every response, with their values
+SECURITY_HEADERS = {
+    "x-content-type-options": "nosniff",
+    "x-frame-options": "DENY",
+    "x-xss-protection": "0",
+}
+
+# Every state /admin/routes may report for a route's circuit breaker
+VALID_CB_STATES = frozenset({"closed", "open", "half-open", "unknown"})
+
+# Parses a raw block of response header fields in one call
+HEADER_PARSER = BytesHeaderParser()
+
+# One request in a curl_multi() batch. Unlike a bare path entry, which uses
+# the batch's shared token, token=None here sends no Authorization header.
+BatchRequest = namedtuple("BatchRequest", "path token method headers",
+                          defaults=(None, "GET", None))
+
+# Separator lines for test and phase headings in the output
+RULE = "=" * 60
+BANNER = "#" * 60
+
+# (label, method, path) requests whose error bodies must share one JSON shape
+ERROR_SHAPE_REQUESTS = (
+    ("404", "GET", "/nonexistent"),
+    ("401", "GET", "/api/users/test"),
+    ("405", "DELETE", "/public/test"),
+)
+ERROR_SHAPE_KEYS = frozenset({"error", "error_code", "message"})
+
+# A single libcurl easy handle used by every fetch() call. Reusing it keeps
+# the connection to the gateway alive between requests instead of paying for
+# a fresh process, DNS lookup and TCP handshake each time.
+session = pycurl.Curl()
+
+# DNS results and the connection pool, shared by the session and every
+# CurlMulti batch. Without the DNS cache a burst of fresh handles starts one
+# resolver thread per request, and closing the multi stalls while those
+# threads wind down. Sharing connections lets each batch pick up the sockets
+# left open by earlier requests instead of handshaking afresh.
+share = pycurl.CurlShare()
+share.setopt(pycurl.SH_SHARE, pycurl.LOCK_DATA_DNS)
+share.setopt(pycurl.SH_SHARE, pycurl.LOCK_DATA_CONNECT)
+session.setopt(pycurl.SHARE, share)  # pycurl keeps this across reset()
+
+
+def b64url(data):
+    """Unpadded base64url encoding, as used for JWT segments."""
+    return base64.urlsafe_b64encode(data).rstrip(b"=")
+
+
+# The HS256 JOSE header is identical for every token, so it is encoded once.
+JWT_HEADER = b64url(b'{"alg":"HS256","typ":"JWT"}')
+SECRET_KEY = SECRET.encode()
+# Claims shared by every token the demo signs
+JWT_CLAIMS = {"iss": "https://auth.example.com", "aud": "api-gateway"}
+
+
+# Tokens are valid for an hour, far longer than a demo run, so each distinct
+# set of claims only needs signing once.
+@functools.lru_cache(maxsize=None)
 def generate_token(sub="user-1", scope="read write", expired=False):
-    exp = int(time.time()) + (-3600 if expired else 3600)
     payload = {
+        **JWT_CLAIMS,
         "sub": sub,
-        "iss": "https://auth.example.com",
-        "aud": "api-gateway",
-        "exp": exp,
+        "exp": int(time.time()) + (-3600 if expired else 3600),
         "scope": scope,
     }
-    return jwt.encode(payload, SECRET, algorithm="HS256")
+    signing_input = JWT_HEADER + b"." + b64url(json.dumps(payload, separators=(",", ":")).encode())
+    signature = b64url(hmac.new(SECRET_KEY, signing_input, hashlib.sha256).digest())
+    return (signing_input + b"." + signature).decode()
+
+
+def filler_body(size, chunk_size=64 * 1024):
+    """Yield size bytes of b"x" in fixed-size chunks without building the whole body."""
+    chunk = b"x" * chunk_size
+    full, rest = divmod(size, chunk_size)
+    for _ in range(full):
+        yield chunk
+    if rest:
+        yield chunk[:rest]
+
+
+def print_body(body, content_type):
+    """Print the first 200 characters of a raw response body.
+
+    The body is truncated before decoding, so a large body is never decoded
+    in full just to show its start. JSON bodies are parsed and re-indented
+    only in VERBOSE mode.
+    """
+    if VERBOSE and content_type.startswith("application/json"):
+        try:
+            print(json.dumps(json.loads(body), indent=2))
+            return
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            pass
+    print(body[:200].decode("utf-8", errors="replace"))
+
+
+def parse_headers(raw):
+    """Parse raw response header bytes from libcurl into an email.message.Message.
+
+    libcurl records every header block it saw (e.g. a 100 Continue before the
+    real response); only the last one describes the body.
+    """
+    final_block = raw.rstrip(b"\r\n").rsplit(b"\r\n\r\n", 1)[-1]
+    _, _, fields = final_block.partition(b"\r\n")
+    return HEADER_PARSER.parsebytes(fields)
+
+
+def show_response(label, method, path, status, resp_headers, body):
+    """Print the labelled TEST block for a response."""
+    body = body.strip()
+    print(f"\n{RULE}")
+    print(f"TEST: {label}")
+    print(f"{method} {path} -> {status}")
+    if body:
+        print_body(body, resp_headers.get("content-type", ""))
 
 
-def curl(method, path, token=None, headers=None, data=None, data_file=None, label=""):
-    """Run a curl request and return (status_code, response_headers_dict).
+def fetch(method, path, token=None, headers=None, data=None, data_stream=None,
+          data_size=None, timeout=15):
+    """Send a request over the shared libcurl session.
 
-    Pass data= for small inline bodies, data_file= for file-based bodies.
+    Returns (status_code, response_headers, body_bytes), where the headers are
+    an email.message.Message with case-insensitive get(). Pass data= for
+    small inline bodies, or data_stream= (an iterable of byte chunks) with
+    data_size= its total length to stream a large body.
     """
-    url = f"{GATEWAY}{path}"
-    cmd = ["curl", "-s", "-X", method, "-w", "\n%{http_code}", "-D", HEADER_DUMP]
+    req_headers = []
     if token:
-        cmd += ["-H", f"Authorization: Bearer {token}"]
+        req_headers.append(f"Authorization: Bearer {token}")
     for k, v in (headers or {}).items():
-        cmd += ["-H", f"{k}: {v}"]
+        req_headers.append(f"{k}: {v}")
+
+    buf = BytesIO()
+    header_buf = BytesIO()
+
+    session.reset()
+    session.setopt(pycurl.URL, GATEWAY + path)
+    session.setopt(pycurl.CUSTOMREQUEST, method)
+    session.setopt(pycurl.HTTPHEADER, req_headers)
+    session.setopt(pycurl.WRITEDATA, buf)
+    session.setopt(pycurl.WRITEHEADER, header_buf)
+    session.setopt(pycurl.TIMEOUT, timeout)
     if data is not None:
-        cmd += ["-d", data]
-    if data_file is not None:
-        cmd += ["--data-binary", f"@{data_file}"]
-    cmd.append(url)
-
-    result = subprocess.run(cmd, capture_output=True, text=True, timeout=15)
-    lines = result.stdout.strip().rsplit("\n", 1)
-    body = lines[0] if len(lines) > 1 else ""
-    status = lines[-1]
-
-    # Parse response headers from the dump file
-    resp_headers = {}
+        session.setopt(pycurl.POSTFIELDS, data)
+
+    if data_stream is not None:
+        chunks = iter(data_stream)
+        pending = b""
+
+        def read_body(size):
+            nonlocal pending
+            if not pending:
+                pending = next(chunks, b"")
+            out, pending = pending[:size], pending[size:]
+            return out
+
+        session.setopt(pycurl.POST, 1)
+        session.setopt(pycurl.READFUNCTION, read_body)
+        session.setopt(pycurl.POSTFIELDSIZE_LARGE, data_size)
+
     try:
-        with open(HEADER_DUMP, "r") as f:
-            for line in f:
-                line = line.strip()
-                if ": " in line:
-                    k, v = line.split(": ", 1)
-                    resp_headers[k.lower()] = v
-    except FileNotFoundError:
-        pass
-
-    print(f"\n{'='*60}")
-    print(f"TEST: {label}")
-    print(f"{method} {path} -> {status}")
-    if body:
-        try:
-            print(json.dumps(json.loads(body), indent=2))
-        except json.JSONDecodeError:
-            print(body[:200])
-    return int(status), resp_headers
+        session.perform()
+        status = session.getinfo(pycurl.RESPONSE_CODE)
+    except pycurl.error as e:
+        # Mirror curl's "000" status for connection-level failures
+        print(f"  (request failed: {e})")
+        status = 0
+    return status, parse_headers(header_buf.getvalue()), buf.getvalue()
+
+
+def curl(method, path, token=None, headers=None, data=None, data_stream=None,
+         data_size=None, label=""):
+    """Run a labelled test request and return (status_code, response_headers)."""
+    status, resp_headers, body = fetch(method, path, token=token, headers=headers, data=data,
+                                       data_stream=data_stream, data_size=data_size)
+    show_response(label, method, path, status, resp_headers, body)
+    return status, resp_headers
+
+
+def curl_multi(paths, token=None, max_connections=0, keep_bodies=False):
+    """Issue a request for every path concurrently and return [(status, raw_headers, body)].
+
+    All transfers are driven by one CurlMulti in this process instead of one
+    request at a time. An entry in paths is either a path, sent as a GET with
+    the shared token, or a BatchRequest to give that request its own token,
+    method or extra headers (a dict). Pass max_connections=1 to queue the
+    requests over a single keep-alive connection. Bodies are discarded
+    (returned as b"") unless keep_bodies is set. Failed transfers report
+    status 0.
+    """
+    multi = pycurl.CurlMulti()
+    if max_connections:
+        multi.setopt(pycurl.M_MAX_HOST_CONNECTIONS, max_connections)
+    handles = []
+    for req in paths:
+        if not isinstance(req, BatchRequest):
+            req = BatchRequest(req, token)
+        c = pycurl.Curl()
+        c.header_buf = BytesIO()
+        c.body_buf = BytesIO() if keep_bodies else None
+        c.setopt(pycurl.SHARE, share)
+        c.setopt(pycurl.URL, GATEWAY + req.path)
+        if keep_bodies:
+            c.setopt(pycurl.WRITEDATA, c.body_buf)
+        else:
+            c.setopt(pycurl.WRITEFUNCTION, lambda chunk: None)  # discard body
+        c.setopt(pycurl.WRITEHEADER, c.header_buf)
+        c.setopt(pycurl.TIMEOUT, 15)
+        if req.method != "GET":
+            c.setopt(pycurl.CUSTOMREQUEST, req.method)
+        req_headers = [f"{k}: {v}" for k, v in (req.headers or {}).items()]
+        if req.token:
+            req_headers.append(f"Authorization: Bearer {req.token}")
+        if req_headers:
+            c.setopt(pycurl.HTTPHEADER, req_headers)
+        multi.add_handle(c)
+        handles.append(c)
+
+    active = len(handles)
+    while active:
+        _, active = multi.perform()
+        if active:
+            # Honour libcurl's own timeout so transfers queued behind a busy
+            # connection are started as soon as it frees up.
+            timeout_ms = multi.timeout()
+            if timeout_ms:
+                multi.select(timeout_ms / 1000 if timeout_ms > 0 else 1.0)
+
+    responses = []
+    for c in handles:
+        body = c.body_buf.getvalue() if keep_bodies else b""
+        responses.append((c.getinfo(pycurl.RESPONSE_CODE), c.header_buf.getvalue(), body))
+        multi.remove_handle(c)
+        c.close()
+    multi.close()
+    return responses
+
+
+def scrape_metrics():
+    """Fetch the raw /metrics exposition bytes, or b"" if the scrape fails."""
+    _, _, body = fetch("GET", "/metrics", timeout=10)
+    return body
+
+
+def metric_tokens(body):
+    """Return the subset of METRIC_TOKENS found in a /metrics scrape body."""
+    # Plain substring tests: bytes.__contains__ is a fast C search, which
+    # beats a regex alternation over the same body for this many tokens.
+    return {t for t in METRIC_TOKENS if t.encode() in body}
+
+
+def parse_json(raw, what):
+    """Parse a response body that must be a JSON object.
+
+    Returns the decoded dict, or records a failed check naming what and
+    returns None when the body is not valid JSON or not an object.
+    """
+    try:
+        doc = json.loads(raw)
+    except (json.JSONDecodeError, UnicodeDecodeError) as e:
+        check(False, f"{what} not valid JSON: {e}")
+        return None
+    if not isinstance(doc, dict):
+        check(False, f"{what} is not a JSON object")
+        return None
+    return doc
+
+
+def json_strings(node):
+    """Yield every string (object keys included) nested anywhere in a parsed JSON document."""
+    if isinstance(node, str):
+        yield node
+    elif isinstance(node, dict):
+        for key, value in node.items():
+            yield key
+            yield from json_strings(value)
+    elif isinstance(node, list):
+        for value in node:
+            yield from json_strings(value)
 
 
 def check(ok, msg=""):
-    global passed, failed
     # Redact sensitive secrets from log messages before printing
     if msg:
         msg_str = str(msg)
@@ -86,37 +350,89 @@ def check(ok, msg=""):
             msg_str = msg_str.replace(SECRET, "***")
     else:
         msg_str = ""
-    if ok:
-        print(f"  PASS{': ' + msg_str if msg_str else ''}")
-        passed += 1
-    else:
-        print(f"  FAIL{': ' + msg_str if msg_str else ''}")
-        failed += 1
+    # Printed next to its TEST: heading; stdout is block-buffered (see main()),
+    # so this costs no flush per line.
+    print(f"  {'PASS' if ok else 'FAIL'}{': ' + msg_str if msg_str else ''}")
+    results.append((bool(ok), msg_str))
     return ok
 
 
+def check_all_ok(statuses, msg):
+    """check() that every integer status is 200.
+
+    Stops at the first non-200 code, and only builds the set of codes seen
+    for the message when there is a failure to explain.
+    """
+    ok = all(s == 200 for s in statuses)
+    return check(ok, msg if ok else f"{msg} (got {set(statuses)})")
+
+
 def wait_for_gateway():
-    print("Waiting for gateway to be ready...")
-    for i in range(30):
+    print("Waiting for gateway to be ready...", flush=True)
+    # Status-only probe: the body is discarded rather than captured and decoded
+    session.reset()
+    session.setopt(pycurl.URL, GATEWAY + "/health")
+    session.setopt(pycurl.WRITEFUNCTION, lambda chunk: None)
+    session.setopt(pycurl.TIMEOUT_MS, 500)
+    # Back off exponentially from 5ms up to 1s between probes, so a gateway
+    # that comes up quickly is noticed quickly.
+    delay = 0.005
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
         try:
-            result = subprocess.run(
-                ["curl", "-s", "-o", "/dev/null", "-w", "%{http_code}", f"{GATEWAY}/health"],
-                capture_output=True, text=True, timeout=2,
-            )
-            if result.stdout.strip() == "200":
+            session.perform()
+            if session.getinfo(pycurl.RESPONSE_CODE) == 200:
                 print("Gateway is ready!")
                 return
-        except (subprocess.TimeoutExpired, Exception):
+        except pycurl.error:
             pass
-        time.sleep(1)
+        time.sleep(delay)
+        delay = min(delay * 1.5, 1.0)
     print("Gateway did not become ready in time")
     sys.exit(1)
 
 
+@functools.lru_cache(maxsize=None)
+def bucket_refill_seconds():
+    """Return how long the slowest emptied rate-limit bucket takes to refill.
+
+    Derived from the gateway's own settings via /admin/config, which is not
+    itself rate limited: the global rate_limit bucket and any per-route
+    rate_override bucket. Returns None if the config cannot be read.
+    """
+    _, _, raw = fetch("GET", "/admin/config", timeout=5)
+    try:
+        config = json.loads(raw)
+        buckets = [config["rate_limit"]]
+        buckets += [route["rate_override"] for route in config.get("routes") or ()
+                    if route.get("rate_override")]
+        return max(b["burst_size"] / b["requests_per_second"] for b in buckets)
+    except (json.JSONDecodeError, KeyError, TypeError, AttributeError, ZeroDivisionError):
+        return None
+
+
+def wait_for_refill():
+    refill = bucket_refill_seconds()
+    # 10% headroom over the computed refill time absorbs scheduling jitter;
+    # without a config to go on, fall back to a fixed 2s.
+    delay = 2.0 if refill is None else refill * 1.1
+    print(f"\n(Waiting {delay:.2f}s for rate limit bucket to refill...)")
+    time.sleep(delay)
+
+
 def main():
-    wait_for_gateway()
+    # Collect test output in stdout's buffer rather than flushing every line
+    # when attached to a terminal; the interpreter flushes it on exit.
+    sys.stdout.reconfigure(line_buffering=False)
 
+    # Sign the small fixed set of tokens the run needs up front, so no test
+    # pays for JWT signing in the middle of its request sequence.
     token = generate_token()
+    expired_token = generate_token(expired=True)
+    read_only_token = generate_token(scope="read")
+
+    wait_for_gateway()
+
     print(f"\nGenerated JWT: {token[:50]}...")
 
     # ── Core Functionality ────────────────────────────────────
@@ -143,13 +459,11 @@ def main():
                       label="Auth route - bad token")
     check(status == 401, f"expected 401, got {status}")
 
-    expired_token = generate_token(expired=True)
     status, _ = curl("GET", "/api/users/123", token=expired_token,
                       label="Auth route - expired token")
     check(status == 401, f"expected 401, got {status}")
 
-    wrong_scope = generate_token(scope="read")
-    status, _ = curl("GET", "/api/users/123", token=wrong_scope,
+    status, _ = curl("GET", "/api/users/123", token=read_only_token,
                       label="Auth route - missing 'write' scope (403 Forbidden)")
     check(status == 403, f"expected 403, got {status}")
 
@@ -160,42 +474,27 @@ def main():
     check(status == 405, f"expected 405, got {status}")
 
     # Rate limiting — fire requests concurrently to exceed burst window
-    print(f"\n{'='*60}")
+    print(f"\n{RULE}")
     print("TEST: Rate limiting (sending 80 concurrent requests to /public/test)")
-    procs = []
-    for i in range(80):
-        p = subprocess.Popen(
-            ["curl", "-s", "-o", "/dev/null", "-w", "%{http_code}", f"{GATEWAY}/public/test"],
-            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
-        )
-        procs.append(p)
-    statuses = {}
-    for p in procs:
-        out, _ = p.communicate(timeout=15)
-        code = out.decode().strip()
-        statuses[code] = statuses.get(code, 0) + 1
-    print(f"Results: {dict(sorted(statuses.items()))}")
-    check("429" in statuses, "expected some 429 responses")
+    statuses = Counter(code for code, _, _ in curl_multi(["/public/test"] * 80))
+    print(f"Results: {statuses.most_common()}")
+    check(429 in statuses, "expected some 429 responses")
 
     # Wait for rate limit bucket to refill before Phase 1 tests
-    print("\n(Waiting 2s for rate limit bucket to refill...)")
-    time.sleep(2)
+    wait_for_refill()
 
     # ── Phase 1: Security Hardening ───────────────────────────
 
-    print(f"\n\n{'#'*60}")
+    print(f"\n\n{BANNER}")
     print("# PHASE 1: SECURITY HARDENING TESTS")
-    print(f"{'#'*60}")
+    print(BANNER)
 
     # Security response headers
     status, hdrs = curl("GET", "/public/hello",
                          label="Security headers on response")
-    check(hdrs.get("x-content-type-options") == "nosniff",
-          f"X-Content-Type-Options = {hdrs.get('x-content-type-options', '(missing)')}")
-    check(hdrs.get("x-frame-options") == "DENY",
-          f"X-Frame-Options = {hdrs.get('x-frame-options', '(missing)')}")
-    check(hdrs.get("x-xss-protection") == "0",
-          f"X-XSS-Protection = {hdrs.get('x-xss-protection', '(missing)')}")
+    wrong = {k: hdrs.get(k, "(missing)") for k, v in SECURITY_HEADERS.items() if hdrs.get(k) != v}
+    check(not wrong, f"security headers wrong: {wrong}" if wrong
+          else f"security headers present: {SECURITY_HEADERS}")
 
     # HSTS must NOT be present over plain HTTP
     check("strict-transport-security" not in hdrs,
@@ -221,33 +520,16 @@ def main():
     check(status == 200, f"expected 200, got {status}")
 
     # Body size limit — oversized body rejected
-    # Default limit is 1MB. Write a 1.5MB file and send via --data-binary @file.
+    # Default limit is 1MB. Stream a 1.5MB body from a generator so it is
+    # never held in memory or written to disk.
     # Use /api/analytics (no retries) so MaxBytesReader triggers on the single attempt.
-    print(f"\n{'='*60}")
-    print("TEST: Body limit - oversized body (1.5MB) rejected")
-    big_file = "/tmp/big_body.bin"
-    with open(big_file, "wb") as f:
-        f.write(b"x" * (1536 * 1024))  # 1.5MB
-    try:
-        over_result = subprocess.run(
-            ["curl", "-s", "-X", "POST", "-w", "\n%{http_code}",
-             "-H", f"Authorization: Bearer {token}",
-             "-H", "Content-Type: application/octet-stream",
-             "--data-binary", f"@{big_file}",
-             "-m", "10",
-             f"{GATEWAY}/api/analytics/ingest"],
-            capture_output=True, text=True, timeout=15,
-        )
-        over_lines = over_result.stdout.strip().rsplit("\n", 1)
-        over_status = over_lines[-1] if over_lines else "0"
-    except (subprocess.TimeoutExpired, Exception) as e:
-        over_status = "timeout"
-        print(f"  (request timed out or errored: {e})")
-    finally:
-        os.remove(big_file)
-    print(f"POST /api/analytics/ingest (1.5MB) -> {over_status}")
-    # Gateway should reject: 413 or connection reset (000) or timeout
-    check(over_status in ("413", "000", "timeout"),
+    over_size = 1536 * 1024  # 1.5MB
+    over_status, _ = curl("POST", "/api/analytics/ingest", token=token,
+                          headers={"Content-Type": "application/octet-stream"},
+                          data_stream=filler_body(over_size), data_size=over_size,
+                          label="Body limit - oversized body (1.5MB) rejected")
+    # Gateway should reject: 413 or connection reset / timeout (status 0)
+    check(over_status in (413, 0),
           f"got {over_status} (expected 413 or connection reset)")
 
     # XFF ignored without trusted proxies
@@ -265,22 +547,15 @@ def main():
 
     # ── Phase 2: Observability & Metrics ─────────────────────
 
-    print(f"\n\n{'#'*60}")
+    print(f"\n\n{BANNER}")
     print("# PHASE 2: OBSERVABILITY & METRICS TESTS")
-    print(f"{'#'*60}")
+    print(BANNER)
 
     # --- /metrics endpoint accessible without auth ---
 
     status, hdrs = curl("GET", "/metrics", label="Metrics endpoint accessible without auth")
     check(status == 200, f"expected 200, got {status}")
 
-    # Fetch raw metrics body for content checks
-    metrics_result = subprocess.run(
-        ["curl", "-s", f"{GATEWAY}/metrics"],
-        capture_output=True, text=True, timeout=10,
-    )
-    metrics_body = metrics_result.stdout
-
     # --- Trigger backend errors and retries ---
     # Hit the echo server's /__status/502 endpoint via /api/users (which has
     # strip_prefix: true and retry_attempts: 2). The backend always returns 502,
@@ -291,49 +566,74 @@ def main():
                       label="Trigger backend 502 (primes error + retry metrics)")
     check(status == 502, f"expected 502, got {status}")
 
-    # Re-scrape metrics now that all 7 families have been observed
-    metrics_result = subprocess.run(
-        ["curl", "-s", f"{GATEWAY}/metrics"],
-        capture_output=True, text=True, timeout=10,
-    )
-    metrics_body = metrics_result.stdout
+    # --- Metrics counters increment after traffic ---
+    # Make targeted requests to produce known counter increments before the
+    # single /metrics scrape below, which then covers every family and label.
+
+    print(f"\n{RULE}")
+    print("TEST: Generate auth failures (missing, bad and insufficient-scope tokens)")
+    auth_failures = curl_multi([
+        BatchRequest("/api/users/metrics-test"),                             # missing token
+        BatchRequest("/api/users/metrics-test", token="totally.not.valid"),  # bad token
+        BatchRequest("/api/users/metrics-test", token=read_only_token),      # wrong scope
+    ])
+    print(f"  Results: {[code for code, _, _ in auth_failures]}")
+
+    # Counters are bumped synchronously in the gateway's handlers; the proxy
+    # only records its totals just after writing the response, so a short
+    # pause is enough to let the last of those land.
+    time.sleep(0.05)
+
+    # Scrape once, now that all 7 families and every counter label have been
+    # observed, and run every content check against that one body.
+    metrics_body = scrape_metrics()
 
     # --- All 7 gateway metric families present ---
 
-    check("gateway_requests_total" in metrics_body,
-          "gateway_requests_total present in /metrics output")
-    check("gateway_request_duration_seconds" in metrics_body,
-          "gateway_request_duration_seconds present in /metrics output")
-    check("gateway_active_connections" in metrics_body,
-          "gateway_active_connections present in /metrics output")
-    check("gateway_rate_limit_hits_total" in metrics_body,
-          "gateway_rate_limit_hits_total present in /metrics output")
-    check("gateway_auth_failures_total" in metrics_body,
-          "gateway_auth_failures_total present in /metrics output")
-    check("gateway_backend_errors_total" in metrics_body,
-          "gateway_backend_errors_total present in /metrics output")
-    check("gateway_retries_total" in metrics_body,
-          "gateway_retries_total present in /metrics output")
+    seen = metric_tokens(metrics_body)
+    for family in METRIC_FAMILIES:
+        check(family in seen, f"{family} present in /metrics output")
 
     # --- Per-route labels in metrics ---
 
-    check('/api/users' in metrics_body,
+    check("/api/users" in seen,
           "per-route label /api/users in metrics output")
 
+    check('gateway_auth_failures_total{reason="missing_token"}' in seen,
+          "auth_failures counter has missing_token label")
+    check('gateway_auth_failures_total{reason="invalid_token"}' in seen,
+          "auth_failures counter has invalid_token label")
+    check('gateway_auth_failures_total{reason="insufficient_scope"}' in seen,
+          "auth_failures counter has insufficient_scope label")
+
+    # request totals with route labels
+    check('route="/api/users"' in seen,
+          "requests_total has route=/api/users label")
+
+    # request duration histogram buckets present
+    check('gateway_request_duration_seconds_bucket{' in seen,
+          "request_duration_seconds histogram buckets present")
+
+    # rate_limit_hits from the earlier burst test
+    check('gateway_rate_limit_hits_total{' in seen,
+          "rate_limit_hits_total incremented (from burst test)")
+
+    # backend_errors from the /__status/502 test
+    check('gateway_backend_errors_total{' in seen,
+          "backend_errors_total incremented (from 502 test)")
+    check('status="502"' in seen,
+          "backend_errors_total has status=502 label")
+
+    # retries from the /__status/502 test (/api/users has retry_attempts: 2)
+    check('gateway_retries_total{' in seen,
+          "retries_total incremented (from 502 retry test)")
+
     # --- /metrics bypasses rate limiting ---
 
-    print(f"\n{'='*60}")
+    print(f"\n{RULE}")
     print("TEST: /metrics bypasses rate limiting")
-    metrics_statuses = []
-    for _ in range(10):
-        r = subprocess.run(
-            ["curl", "-s", "-o", "/dev/null", "-w", "%{http_code}",
-             f"{GATEWAY}/metrics"],
-            capture_output=True, text=True, timeout=5,
-        )
-        metrics_statuses.append(r.stdout.strip())
-    check(all(s == "200" for s in metrics_statuses),
-          f"all /metrics requests returned 200 (got {set(metrics_statuses)})")
+    metrics_statuses = [code for code, _, _ in curl_multi(["/metrics"] * 10, max_connections=1)]
+    check_all_ok(metrics_statuses, "all /metrics requests returned 200")
 
     # --- X-Request-ID generated when absent ---
 
@@ -356,107 +656,36 @@ def main():
     # --- X-Request-ID propagated to backend ---
 
     trace_id = "trace-propagation-test-999"
-    prop_result = subprocess.run(
-        ["curl", "-s", "-H", f"Authorization: Bearer {token}",
-         "-H", f"X-Request-ID: {trace_id}",
-         f"{GATEWAY}/api/users/check-trace"],
-        capture_output=True, text=True, timeout=10,
-    )
-    print(f"\n{'='*60}")
+    _, _, prop_raw = fetch("GET", "/api/users/check-trace",
+                           token=token, headers={"X-Request-ID": trace_id}, timeout=10)
+    print(f"\n{RULE}")
     print("TEST: X-Request-ID propagated to backend")
-    try:
-        echo_resp = json.loads(prop_result.stdout)
+    echo_resp = parse_json(prop_raw, "echo response")
+    if echo_resp is not None:
         backend_headers = echo_resp.get("headers", {})
         got_trace = backend_headers.get("X-Request-Id",
                         backend_headers.get("x-request-id", ""))
         print(f"  Backend received X-Request-ID: {got_trace}")
         check(got_trace == trace_id,
               f"backend saw X-Request-ID={got_trace}, expected {trace_id}")
-    except (json.JSONDecodeError, KeyError) as e:
-        print(f"  Could not parse echo response: {e}")
-        check(False, "failed to verify backend propagation")
 
     # --- X-Request-ID unique per request ---
 
-    print(f"\n{'='*60}")
+    print(f"\n{RULE}")
     print("TEST: X-Request-ID unique per request")
-    ids = set()
-    for _ in range(10):
-        r = subprocess.run(
-            ["curl", "-s", "-D", HEADER_DUMP, "-o", "/dev/null",
-             f"{GATEWAY}/public/hello"],
-            capture_output=True, text=True, timeout=5,
-        )
-        try:
-            with open(HEADER_DUMP, "r") as f:
-                for line in f:
-                    if line.lower().startswith("x-request-id:"):
-                        ids.add(line.split(":", 1)[1].strip())
-        except FileNotFoundError:
-            pass
+    raw_headers = b"".join(h for _, h, _ in curl_multi(["/public/hello"] * 10, max_connections=1))
+    ids = set(REQUEST_ID_RE.findall(raw_headers))
     print(f"  Generated {len(ids)} unique IDs from 10 requests")
     check(len(ids) == 10, f"expected 10 unique IDs, got {len(ids)}")
 
-    # --- Metrics counters increment after traffic ---
-    # Make targeted requests to produce known counter increments,
-    # then re-scrape /metrics and verify counts.
-
-    # auth failure: missing token
-    curl("GET", "/api/users/metrics-test", label="Generate auth failure (missing token)")
-    # auth failure: bad token
-    curl("GET", "/api/users/metrics-test", token="totally.not.valid",
-         label="Generate auth failure (bad token)")
-    # auth failure: wrong scope
-    no_write = generate_token(scope="read")
-    curl("GET", "/api/users/metrics-test", token=no_write,
-         label="Generate auth failure (insufficient scope)")
-
-    time.sleep(0.5)
-
-    metrics_result2 = subprocess.run(
-        ["curl", "-s", f"{GATEWAY}/metrics"],
-        capture_output=True, text=True, timeout=10,
-    )
-    metrics_body2 = metrics_result2.stdout
-
-    check('gateway_auth_failures_total{reason="missing_token"}' in metrics_body2,
-          "auth_failures counter has missing_token label")
-    check('gateway_auth_failures_total{reason="invalid_token"}' in metrics_body2,
-          "auth_failures counter has invalid_token label")
-    check('gateway_auth_failures_total{reason="insufficient_scope"}' in metrics_body2,
-          "auth_failures counter has insufficient_scope label")
-
-    # request totals with route labels
-    check('route="/api/users"' in metrics_body2,
-          "requests_total has route=/api/users label")
-
-    # request duration histogram buckets present
-    check('gateway_request_duration_seconds_bucket{' in metrics_body2,
-          "request_duration_seconds histogram buckets present")
-
-    # rate_limit_hits from the earlier burst test
-    check('gateway_rate_limit_hits_total{' in metrics_body2,
-          "rate_limit_hits_total incremented (from burst test)")
-
-    # backend_errors from the /__status/502 test
-    check('gateway_backend_errors_total{' in metrics_body2,
-          "backend_errors_total incremented (from 502 test)")
-    check('status="502"' in metrics_body2,
-          "backend_errors_total has status=502 label")
-
-    # retries from the /__status/502 test (/api/users has retry_attempts: 2)
-    check('gateway_retries_total{' in metrics_body2,
-          "retries_total incremented (from 502 retry test)")
-
     # ── Performance Fixes Validation ─────────────────────────
 
-    print(f"\n\n{'#'*60}")
+    print(f"\n\n{BANNER}")
     print("# PERFORMANCE FIXES VALIDATION")
-    print(f"{'#'*60}")
+    print(BANNER)
 
     # Wait for rate limit bucket to refill from earlier tests
-    print("\n(Waiting 2s for rate limit bucket to refill...)")
-    time.sleep(2)
+    wait_for_refill()
 
     # --- Fix #1: No double backend hit on retry-enabled routes ---
     # /api/users has retry_attempts: 2 and strip_prefix: true.
@@ -468,24 +697,17 @@ def main():
     check(status == 200, f"expected 200, got {status}")
 
     # Verify the response body is well-formed JSON from the echo server
-    fix1_result = subprocess.run(
-        ["curl", "-s", "-H", f"Authorization: Bearer {token}",
-         f"{GATEWAY}/api/users/perf-fix1-unique-path"],
-        capture_output=True, text=True, timeout=10,
-    )
-    print(f"\n{'='*60}")
+    _, _, fix1_raw = fetch("GET", "/api/users/perf-fix1-unique-path", token=token, timeout=10)
+    print(f"\n{RULE}")
     print("TEST: Fix #1: Buffer replay preserves full response body")
-    try:
-        fix1_body = json.loads(fix1_result.stdout)
+    fix1_body = parse_json(fix1_raw, "buffer replay response")
+    if fix1_body is not None:
         # strip_prefix removes /api/users, so backend sees /perf-fix1-unique-path
         got_path = fix1_body.get("path", "")
         check(got_path == "/perf-fix1-unique-path",
               f"buffer replay preserved response body (path={got_path})")
         check(fix1_body.get("service") == "users-service",
               f"response from correct backend (service={fix1_body.get('service')})")
-    except (json.JSONDecodeError, KeyError) as e:
-        print(f"  Could not parse echo response: {e}")
-        check(False, "buffer replay response parse failed")
 
     # Verify response headers are preserved through buffer replay
     status, hdrs = curl("GET", "/api/users/perf-fix1-headers", token=token,
@@ -497,48 +719,35 @@ def main():
 
     # --- Fix #4: Pre-serialized error responses have correct JSON structure ---
 
-    print(f"\n{'='*60}")
+    print(f"\n{RULE}")
     print("TEST: Fix #4: Pre-serialized error bodies are valid JSON")
-    err_result = subprocess.run(
-        ["curl", "-s", f"{GATEWAY}/nonexistent/perf-test"],
-        capture_output=True, text=True, timeout=10,
-    )
-    try:
-        err_body = json.loads(err_result.stdout)
+    _, _, err_raw = fetch("GET", "/nonexistent/perf-test", timeout=10)
+    err_body = parse_json(err_raw, "404 response")
+    if err_body is not None:
         check(err_body.get("error") == "Not Found",
               f"404 error field correct: {err_body.get('error')}")
         check(err_body.get("message") == "no matching route",
               f"404 message field correct: {err_body.get('message')}")
-    except (json.JSONDecodeError, KeyError) as e:
-        check(False, f"404 response not valid JSON: {e}")
 
     # Pre-serialized 401 (missing auth)
-    err401_result = subprocess.run(
-        ["curl", "-s", f"{GATEWAY}/api/users/perf-test"],
-        capture_output=True, text=True, timeout=10,
-    )
-    try:
-        err401 = json.loads(err401_result.stdout)
+    _, _, err401_raw = fetch("GET", "/api/users/perf-test", timeout=10)
+    err401 = parse_json(err401_raw, "401 response")
+    if err401 is not None:
         check(err401.get("error") == "Unauthorized",
               f"401 error field correct: {err401.get('error')}")
         check(err401.get("message") == "missing or malformed Authorization header",
               f"401 message field correct: {err401.get('message')}")
-    except (json.JSONDecodeError, KeyError) as e:
-        check(False, f"401 response not valid JSON: {e}")
 
     # --- Fix #5: Rate limit metrics still have correct route labels ---
     # The combined single-scan limitsForPath now returns the route prefix.
 
-    print(f"\n{'='*60}")
+    print(f"\n{RULE}")
     print("TEST: Fix #5: Route labels preserved after single-scan refactor")
-    final_metrics = subprocess.run(
-        ["curl", "-s", f"{GATEWAY}/metrics"],
-        capture_output=True, text=True, timeout=10,
-    ).stdout
-
-    check('route="/api/users"' in final_metrics,
+    # Both series were provoked before the Phase 2 scrape and counters only
+    # grow, so that scrape's tokens answer this without another request.
+    check('route="/api/users"' in seen,
           "route label /api/users present in metrics")
-    check('gateway_rate_limit_hits_total{' in final_metrics,
+    check('gateway_rate_limit_hits_total{' in seen,
           "rate_limit_hits_total counter still working after refactor")
 
     # --- Fix #7: Path boundary enforcement with shared routing package ---
@@ -556,39 +765,27 @@ def main():
     status, hdrs = curl("GET", "/public/perf-uuid-test",
                          label="Fix #8: UUID format valid after hex.Encode optimization")
     req_id = hdrs.get("x-request-id", "")
-    parts = req_id.split("-")
-    check(len(parts) == 5, f"UUID has 5 dash-separated parts: {req_id}")
-    # Verify part lengths: 8-4-4-4-12
-    if len(parts) == 5:
-        expected_lens = [8, 4, 4, 4, 12]
-        actual_lens = [len(p) for p in parts]
-        check(actual_lens == expected_lens,
-              f"UUID part lengths {actual_lens} match {expected_lens}")
-        # Verify all hex characters
-        all_hex = all(c in "0123456789abcdef-" for c in req_id)
-        check(all_hex, f"UUID contains only hex chars: {req_id}")
+    check(UUID_RE.fullmatch(req_id) is not None,
+          f"UUID is lowercase hex in 8-4-4-4-12 form: {req_id}")
 
     # --- Fix #11: /ready concurrent dials + TTL cache ---
     # Hit /ready multiple times rapidly. With the 5s TTL cache,
     # responses should be fast and consistent.
 
-    print(f"\n{'='*60}")
-    print("TEST: Fix #11: /ready TTL cache (10 rapid requests)")
-    ready_statuses = []
-    ready_start = time.time()
-    for _ in range(10):
-        r = subprocess.run(
-            ["curl", "-s", "-o", "/dev/null", "-w", "%{http_code}",
-             f"{GATEWAY}/ready"],
-            capture_output=True, text=True, timeout=5,
-        )
-        ready_statuses.append(r.stdout.strip())
-    ready_elapsed = time.time() - ready_start
-    check(all(s == "200" for s in ready_statuses),
-          f"all /ready returned 200 (got {set(ready_statuses)})")
-    # With cache, 10 serial requests should complete well under 5s
-    check(ready_elapsed < 5.0,
-          f"/ready 10x completed in {ready_elapsed:.2f}s (cache working)")
+    print(f"\n{RULE}")
+    print("TEST: Fix #11: /ready TTL cache (10 concurrent requests)")
+    # One untimed probe pays for the cold backend dials and fills the cache,
+    # so the timed batch below measures cached responses only.
+    fetch("GET", "/ready", timeout=10)
+    ready_start = time.perf_counter()
+    ready_statuses = [code for code, _, _ in curl_multi(["/ready"] * 10)]
+    ready_elapsed = time.perf_counter() - ready_start
+    check_all_ok(ready_statuses, "all /ready returned 200")
+    # Served from the 5s readiness cache the batch takes a few milliseconds.
+    # 500ms leaves room for container scheduling jitter, but not for requests
+    # that fall through to backend dials (each allowed up to 2s).
+    check(ready_elapsed < 0.5,
+          f"/ready 10x completed in {ready_elapsed * 1000:.0f}ms (cache working)")
 
     # --- Fix #12: CORS headers conditional on Origin header ---
 
@@ -610,138 +807,101 @@ def main():
     # --- Fix #3: RWMutex concurrency under load ---
     # Send many concurrent requests and verify none are dropped.
 
-    print(f"\n{'='*60}")
+    print(f"\n{RULE}")
     print("TEST: Fix #3: Concurrent requests handled (40 parallel)")
-    conc_procs = []
-    for i in range(40):
-        p = subprocess.Popen(
-            ["curl", "-s", "-o", "/dev/null", "-w", "%{http_code}",
-             "-H", f"Authorization: Bearer {token}",
-             f"{GATEWAY}/api/users/concurrent-{i}"],
-            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
-        )
-        conc_procs.append(p)
-    conc_statuses = {}
-    for p in conc_procs:
-        out, _ = p.communicate(timeout=15)
-        code = out.decode().strip()
-        conc_statuses[code] = conc_statuses.get(code, 0) + 1
-    print(f"  Results: {dict(sorted(conc_statuses.items()))}")
-    total_conc = sum(conc_statuses.values())
+    conc_paths = [f"/api/users/concurrent-{i}" for i in range(40)]
+    conc_statuses = Counter(code for code, _, _ in curl_multi(conc_paths, token=token))
+    print(f"  Results: {conc_statuses.most_common()}")
+    total_conc = conc_statuses.total()
     check(total_conc == 40, f"all 40 requests completed (got {total_conc})")
-    success_count = conc_statuses.get("200", 0)
+    success_count = conc_statuses[200]
     check(success_count >= 30,
           f"at least 30/40 returned 200 ({success_count}, rest may be rate-limited)")
 
     # ── Phase 4: Operational Hardening ────────────────────────
 
-    print(f"\n\n{'#'*60}")
+    print(f"\n\n{BANNER}")
     print("# PHASE 4: OPERATIONAL HARDENING TESTS")
-    print(f"{'#'*60}")
+    print(BANNER)
 
     # Wait for rate limit bucket to refill from earlier tests
-    print("\n(Waiting 2s for rate limit bucket to refill...)")
-    time.sleep(2)
+    wait_for_refill()
 
     # --- 4.1: Structured Error Taxonomy ---
     # All error responses must include error_code field with GATEWAY_* prefix.
 
-    print(f"\n{'='*60}")
+    # The error probes are independent of each other, so they go out as one
+    # concurrent batch; the 502 one waits out the proxy's retry backoff while
+    # the rest complete.
+    custom_rid = "phase4-error-trace-001"
+    error_probes = curl_multi([
+        "/nonexistent/phase4-test",
+        "/api/users/phase4-test",
+        BatchRequest("/api/users/phase4-test", token="garbage.not.valid"),
+        BatchRequest("/api/users/phase4-test", token=read_only_token),
+        BatchRequest("/public/phase4-test", method="DELETE"),
+        BatchRequest("/nonexistent/request-id-test", headers={"X-Request-ID": custom_rid}),
+        BatchRequest("/api/users/__status/502", token=token),
+    ], keep_bodies=True)
+    err404_raw, err401_raw, err401bad_raw, err403_raw, err405_raw, errid_raw = (
+        body for _, _, body in error_probes[:6])
+    status502, headers502, body502 = error_probes[6]
+
+    print(f"\n{RULE}")
     print("TEST: Error taxonomy - 404 has error_code field")
-    err404_result = subprocess.run(
-        ["curl", "-s", f"{GATEWAY}/nonexistent/phase4-test"],
-        capture_output=True, text=True, timeout=10,
-    )
-    try:
-        err404 = json.loads(err404_result.stdout)
+    err404 = parse_json(err404_raw, "404 response")
+    if err404 is not None:
         check(err404.get("error_code") == "GATEWAY_ROUTE_NOT_FOUND",
               f"error_code = {err404.get('error_code')}")
         check(err404.get("error") == "Not Found",
               f"error = {err404.get('error')}")
         check("message" in err404,
               f"message field present: {err404.get('message')}")
-    except (json.JSONDecodeError, KeyError) as e:
-        check(False, f"404 response not valid JSON: {e}")
 
     # 401 missing token → GATEWAY_AUTH_MISSING_TOKEN
-    err401_result = subprocess.run(
-        ["curl", "-s", f"{GATEWAY}/api/users/phase4-test"],
-        capture_output=True, text=True, timeout=10,
-    )
-    print(f"\n{'='*60}")
+    print(f"\n{RULE}")
     print("TEST: Error taxonomy - 401 missing token has error_code")
-    try:
-        err401 = json.loads(err401_result.stdout)
+    err401 = parse_json(err401_raw, "401 response")
+    if err401 is not None:
         check(err401.get("error_code") == "GATEWAY_AUTH_MISSING_TOKEN",
               f"error_code = {err401.get('error_code')}")
-    except (json.JSONDecodeError, KeyError) as e:
-        check(False, f"401 response not valid JSON: {e}")
 
     # 401 invalid token → GATEWAY_AUTH_INVALID_TOKEN
-    err401bad_result = subprocess.run(
-        ["curl", "-s", "-H", "Authorization: Bearer garbage.not.valid",
-         f"{GATEWAY}/api/users/phase4-test"],
-        capture_output=True, text=True, timeout=10,
-    )
-    print(f"\n{'='*60}")
+    print(f"\n{RULE}")
     print("TEST: Error taxonomy - 401 invalid token has error_code")
-    try:
-        err401bad = json.loads(err401bad_result.stdout)
+    err401bad = parse_json(err401bad_raw, "401 response")
+    if err401bad is not None:
         check(err401bad.get("error_code") == "GATEWAY_AUTH_INVALID_TOKEN",
               f"error_code = {err401bad.get('error_code')}")
-    except (json.JSONDecodeError, KeyError) as e:
-        check(False, f"401 response not valid JSON: {e}")
 
     # 403 insufficient scope → GATEWAY_AUTH_INSUFFICIENT_SCOPE
-    read_only_token = generate_token(scope="read")
-    err403_result = subprocess.run(
-        ["curl", "-s", "-H", f"Authorization: Bearer {read_only_token}",
-         f"{GATEWAY}/api/users/phase4-test"],
-        capture_output=True, text=True, timeout=10,
-    )
-    print(f"\n{'='*60}")
+    print(f"\n{RULE}")
     print("TEST: Error taxonomy - 403 insufficient scope has error_code")
-    try:
-        err403 = json.loads(err403_result.stdout)
+    err403 = parse_json(err403_raw, "403 response")
+    if err403 is not None:
         check(err403.get("error_code") == "GATEWAY_AUTH_INSUFFICIENT_SCOPE",
               f"error_code = {err403.get('error_code')}")
-    except (json.JSONDecodeError, KeyError) as e:
-        check(False, f"403 response not valid JSON: {e}")
 
     # 405 method not allowed → GATEWAY_METHOD_NOT_ALLOWED
-    err405_result = subprocess.run(
-        ["curl", "-s", "-X", "DELETE", f"{GATEWAY}/public/phase4-test"],
-        capture_output=True, text=True, timeout=10,
-    )
-    print(f"\n{'='*60}")
+    print(f"\n{RULE}")
     print("TEST: Error taxonomy - 405 has error_code")
-    try:
-        err405 = json.loads(err405_result.stdout)
+    err405 = parse_json(err405_raw, "405 response")
+    if err405 is not None:
         check(err405.get("error_code") == "GATEWAY_METHOD_NOT_ALLOWED",
               f"error_code = {err405.get('error_code')}")
-    except (json.JSONDecodeError, KeyError) as e:
-        check(False, f"405 response not valid JSON: {e}")
 
     # Error response includes request_id when X-Request-ID is set
-    custom_rid = "phase4-error-trace-001"
-    errid_result = subprocess.run(
-        ["curl", "-s", "-H", f"X-Request-ID: {custom_rid}",
-         f"{GATEWAY}/nonexistent/request-id-test"],
-        capture_output=True, text=True, timeout=10,
-    )
-    print(f"\n{'='*60}")
+    print(f"\n{RULE}")
     print("TEST: Error taxonomy - request_id included in error response")
-    try:
-        errid = json.loads(errid_result.stdout)
+    errid = parse_json(errid_raw, "error response")
+    if errid is not None:
         check(errid.get("request_id") == custom_rid,
               f"request_id = {errid.get('request_id')}")
-    except (json.JSONDecodeError, KeyError) as e:
-        check(False, f"error response not valid JSON: {e}")
 
     # 502 upstream error → GATEWAY_UPSTREAM_UNAVAILABLE
-    status, _ = curl("GET", "/api/users/__status/502", token=token,
-                      label="Error taxonomy - 502 upstream has error_code")
-    check(status == 502, f"expected 502, got {status}")
+    show_response("Error taxonomy - 502 upstream has error_code", "GET",
+                  "/api/users/__status/502", status502, parse_headers(headers502), body502)
+    check(status502 == 502, f"expected 502, got {status502}")
 
     # --- 4.2: Admin API - /admin/routes ---
 
@@ -749,15 +909,26 @@ def main():
                       label="Admin API - GET /admin/routes")
     check(status == 200, f"expected 200, got {status}")
 
-    routes_result = subprocess.run(
-        ["curl", "-s", f"{GATEWAY}/admin/routes"],
-        capture_output=True, text=True, timeout=10,
-    )
-    print(f"\n{'='*60}")
+    # Generate some traffic first so there are rate limiter entries
+    for _ in range(3):
+        fetch("GET", "/public/limiter-test", timeout=5)
+
+    # Fetch every admin view the 4.2-4.5 checks need in one concurrent volley
+    admin_views = curl_multi([
+        "/admin/routes",
+        "/admin/config",
+        "/admin/limiters",
+        "/admin/limiters?page=0&page_size=1",
+    ], keep_bodies=True)
+    routes_raw, config_raw, limiters_raw, paginated_raw = (body for _, _, body in admin_views)
+
+    print(f"\n{RULE}")
     print("TEST: Admin API - /admin/routes response structure")
-    try:
-        routes_resp = json.loads(routes_result.stdout)
+    routes_by_prefix = {}  # built once here, reused by the 4.9 check
+    routes_resp = parse_json(routes_raw, "/admin/routes response")
+    if routes_resp is not None:
         admin_routes = routes_resp.get("routes", [])
+        routes_by_prefix = {r.get("path_prefix"): r for r in admin_routes}
         check(len(admin_routes) >= 3,
               f"expected at least 3 routes, got {len(admin_routes)}")
 
@@ -775,42 +946,38 @@ def main():
               "route has timeout_ms field")
 
         # Verify circuit breaker states are valid
-        valid_cb_states = {"closed", "open", "half-open", "unknown"}
-        for route in admin_routes:
-            cb_state = route.get("circuit_breaker_state", "")
-            if cb_state not in valid_cb_states:
-                check(False, f"invalid circuit_breaker_state: {cb_state}")
-                break
-        else:
+        bad_route = next((r for r in admin_routes
+                          if r.get("circuit_breaker_state", "") not in VALID_CB_STATES), None)
+        if bad_route is None:
             check(True, "all circuit_breaker_state values are valid")
+        else:
+            check(False, f"invalid circuit_breaker_state: {bad_route.get('circuit_breaker_state', '')}")
 
         # Verify /api/users route is present with correct details
-        users_route = next((r for r in admin_routes if r["path_prefix"] == "/api/users"), None)
+        users_route = routes_by_prefix.get("/api/users")
         check(users_route is not None, "/api/users route found in admin response")
         if users_route:
             check(users_route.get("auth_required") is True,
                   f"/api/users auth_required = {users_route.get('auth_required')}")
             check(users_route.get("circuit_breaker_state") == "closed",
                   f"/api/users circuit_breaker = {users_route.get('circuit_breaker_state')}")
-    except (json.JSONDecodeError, KeyError) as e:
-        check(False, f"/admin/routes response not valid JSON: {e}")
 
     # --- 4.3: Admin API - /admin/config ---
 
-    config_result = subprocess.run(
-        ["curl", "-s", f"{GATEWAY}/admin/config"],
-        capture_output=True, text=True, timeout=10,
-    )
-    print(f"\n{'='*60}")
+    print(f"\n{RULE}")
     print("TEST: Admin API - /admin/config redacts jwt_secret")
-    try:
-        config_resp = json.loads(config_result.stdout)
+    # Raw scan first: it still runs if the body is not valid JSON, and it
+    # catches the secret wherever it appears, escaped forms aside.
+    check(SECRET.encode() not in config_raw,
+          "raw JWT_SECRET not present anywhere in config response body")
+    config_resp = parse_json(config_raw, "/admin/config response")
+    if config_resp is not None:
         auth_cfg = config_resp.get("auth", {})
         jwt_secret = auth_cfg.get("jwt_secret", "")
         check(jwt_secret == "***",
               f"jwt_secret redacted to '***' (got '{jwt_secret}')")
-        check(SECRET not in config_result.stdout,
-              "raw JWT_SECRET not leaked in config response")
+        check(not any(SECRET in v for v in json_strings(config_resp)),
+              "raw JWT_SECRET not leaked in any config key or value")
 
         # Verify config has expected structure
         check("server" in config_resp, "config has server section")
@@ -822,26 +989,13 @@ def main():
         logging_cfg = config_resp.get("logging", {})
         check(logging_cfg.get("body_logging") is True,
               f"logging.body_logging = {logging_cfg.get('body_logging')}")
-    except (json.JSONDecodeError, KeyError) as e:
-        check(False, f"/admin/config response not valid JSON: {e}")
 
     # --- 4.4: Admin API - /admin/limiters ---
 
-    # Generate some traffic first so there are rate limiter entries
-    for _ in range(3):
-        subprocess.run(
-            ["curl", "-s", "-o", "/dev/null", f"{GATEWAY}/public/limiter-test"],
-            capture_output=True, text=True, timeout=5,
-        )
-
-    limiters_result = subprocess.run(
-        ["curl", "-s", f"{GATEWAY}/admin/limiters"],
-        capture_output=True, text=True, timeout=10,
-    )
-    print(f"\n{'='*60}")
+    print(f"\n{RULE}")
     print("TEST: Admin API - /admin/limiters response structure")
-    try:
-        limiters_resp = json.loads(limiters_result.stdout)
+    limiters_resp = parse_json(limiters_raw, "/admin/limiters response")
+    if limiters_resp is not None:
         check("entries" in limiters_resp,
               "limiters response has 'entries' field")
         check("total" in limiters_resp,
@@ -860,26 +1014,18 @@ def main():
                   f"limiter entry has 'burst': {entry.get('burst')}")
         else:
             check(True, "no entries (demo container may share IP)")
-    except (json.JSONDecodeError, KeyError) as e:
-        check(False, f"/admin/limiters response not valid JSON: {e}")
 
     # --- 4.5: Admin API - Pagination on /admin/limiters ---
 
-    paginated_result = subprocess.run(
-        ["curl", "-s", f"{GATEWAY}/admin/limiters?page=0&page_size=1"],
-        capture_output=True, text=True, timeout=10,
-    )
-    print(f"\n{'='*60}")
+    print(f"\n{RULE}")
     print("TEST: Admin API - /admin/limiters pagination")
-    try:
-        paginated = json.loads(paginated_result.stdout)
+    paginated = parse_json(paginated_raw, "paginated limiters")
+    if paginated is not None:
         page_entries = paginated.get("entries", [])
         check(len(page_entries) <= 1,
               f"page_size=1 returned {len(page_entries)} entries (expected <= 1)")
         check(paginated.get("page") == 0,
               f"page = {paginated.get('page')}")
-    except (json.JSONDecodeError, KeyError) as e:
-        check(False, f"paginated limiters not valid JSON: {e}")
 
     # --- 4.6: Admin API - method not allowed ---
 
@@ -896,74 +1042,51 @@ def main():
 
     # --- 4.8: Admin API bypasses rate limiting ---
 
-    print(f"\n{'='*60}")
+    print(f"\n{RULE}")
     print("TEST: Admin API - /admin/routes bypasses rate limiting")
-    admin_statuses = []
-    for _ in range(15):
-        r = subprocess.run(
-            ["curl", "-s", "-o", "/dev/null", "-w", "%{http_code}",
-             f"{GATEWAY}/admin/routes"],
-            capture_output=True, text=True, timeout=5,
-        )
-        admin_statuses.append(r.stdout.strip())
-    check(all(s == "200" for s in admin_statuses),
-          f"all /admin/routes requests returned 200 (got {set(admin_statuses)})")
+    admin_statuses = [code for code, _, _ in curl_multi(["/admin/routes"] * 15)]
+    check_all_ok(admin_statuses, "all /admin/routes requests returned 200")
 
     # --- 4.9: Per-route log levels configured ---
     # Verify the /health route with log_level: "none" is recognized in admin routes
 
-    print(f"\n{'='*60}")
+    print(f"\n{RULE}")
     print("TEST: Per-route log levels - /health route configured")
-    routes_result2 = subprocess.run(
-        ["curl", "-s", f"{GATEWAY}/admin/routes"],
-        capture_output=True, text=True, timeout=10,
-    )
-    try:
-        routes_resp2 = json.loads(routes_result2.stdout)
-        health_route = next(
-            (r for r in routes_resp2.get("routes", [])
-             if r["path_prefix"] == "/health"),
-            None,
-        )
-        check(health_route is not None,
-              "/health route present in admin routes")
-    except (json.JSONDecodeError, KeyError) as e:
-        check(False, f"admin routes parse error: {e}")
+    check("/health" in routes_by_prefix,
+          "/health route present in admin routes")
 
     # --- 4.10: Error responses are consistent across all error types ---
     # Verify every error response has the same JSON structure:
     # {error, error_code, message} with optional request_id.
 
-    print(f"\n{'='*60}")
+    print(f"\n{RULE}")
     print("TEST: Error response consistency across all error types")
-    error_tests = [
-        ("404", ["curl", "-s", f"{GATEWAY}/nonexistent"]),
-        ("401", ["curl", "-s", f"{GATEWAY}/api/users/test"]),
-        ("405", ["curl", "-s", "-X", "DELETE", f"{GATEWAY}/public/test"]),
-    ]
-    for expected_label, cmd in error_tests:
-        r = subprocess.run(cmd, capture_output=True, text=True, timeout=10)
-        try:
-            body = json.loads(r.stdout)
-            has_error = "error" in body
-            has_code = "error_code" in body
-            has_msg = "message" in body
-            all_present = has_error and has_code and has_msg
-            check(all_present,
-                  f"{expected_label}: error={has_error} error_code={has_code} message={has_msg}")
+    shape_probes = curl_multi([BatchRequest(path, method=method)
+                               for _, method, path in ERROR_SHAPE_REQUESTS], keep_bodies=True)
+    for (expected_label, _, _), (_, _, raw) in zip(ERROR_SHAPE_REQUESTS, shape_probes):
+        body = parse_json(raw, f"{expected_label} response")
+        if body is not None:
+            missing = ERROR_SHAPE_KEYS - body.keys()
+            check(not missing,
+                  f"{expected_label}: missing keys {sorted(missing)}" if missing
+                  else f"{expected_label}: error, error_code and message present")
             # Verify error_code starts with GATEWAY_
-            if has_code:
+            if "error_code" in body:
                 check(body["error_code"].startswith("GATEWAY_"),
                       f"{expected_label}: error_code starts with GATEWAY_: {body['error_code']}")
-        except (json.JSONDecodeError, KeyError) as e:
-            check(False, f"{expected_label} response not valid JSON: {e}")
 
     # ── Summary ───────────────────────────────────────────────
 
-    total = passed + failed
-    print(f"\n{'='*60}")
+    failures = [msg for ok, msg in results if not ok]
+    total = len(results)
+    failed = len(failures)
+    passed = total - failed
+    print(f"\n{RULE}")
+    if failures:
+        print("Failed checks:")
+        print("\n".join(f"  FAIL{': ' + msg if msg else ''}" for msg in failures))
     print(f"RESULTS: {passed}/{total} passed, {failed} failed")
-    print(f"{'='*60}")
+    print(f"{RULE}")
     if failed > 0:
         sys.exit(1)
 